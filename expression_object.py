@@ -80,12 +80,87 @@ make use of the caching by creatin a top-level object [!B] that references
 the child [B] and has an inversion list of [1].
 This way the value [B] can be gathered as always, and the inversion is
 taking place in a pipe-through kind of expression object.
+
+
+Caching results for multiple configurations.
+The single _cached_value of an object is lost as soon as everything gets
+invalidated, which happens every time we switch to another configuration.
+Switching back and forth between a handful of configurations would then
+always mean evaluating everything again.
+Each object therefore knows its support set, the basic values it actually
+depends on (collected from all its leaves). The values of these basic values
+in the current configuration form a key under which the result of the object
+is remembered in a small LRU cache. If the support values match a
+configuration seen before, the result is returned without touching any child,
+no matter what unrelated basic values changed in the meantime.
+The lookup is only done for the objects evaluated through is_true() (the root
+expressions), for every sub-expression building the key would cost about as
+much as evaluating it. Even at the root, building the key for configurations
+that never repeat costs about as much as evaluating, so the result cache is
+off by default. Set RESULT_CACHE_SIZE to the number of configurations to
+remember when switching back and forth between them.
+
+
+Lazily fetched basic values.
+When the basic values are expensive to fetch (from some store instead of
+a dict), having to know all of them before evaluating is wasteful, since
+short-circuiting means many of them are never read.
+basic_value_dict may therefore also be a LazyBasicValueDict, which asks a
+BasicValueProvider for each value on first access and keeps it until the
+next configuration gets its own LazyBasicValueDict.
+With a prefetch_count, the values of the next single-value children of an
+object are fetched together in one bulk call instead.
+As building the key of the result cache would fetch the complete support
+set, the result cache is not used with lazily fetched values.
+See expression_object_async for evaluating with an asynchronous provider.
+
+
+Evaluating many configurations.
+evaluate_configurations() evaluates a list of expressions for a list of
+configurations. Instead of a list of booleans per expression, it can
+return a compressed ResultSet of the configurations each expression is
+true for (see result_set), which only needs memory for the variation of
+the results instead of for every single one.
+
+
+Factoring common sub-expressions.
+Objects are only shared when a complete sub-expression matches, so
+  a and b and c and x
+  a and b and c and y
+share nothing but their leaves, although [a and b and c] is evaluated twice.
+factor_common_subexpressions() looks at the children of all AND and OR
+objects, repeatedly takes the pair of neighbouring children (including their
+inversion) that occurs in most objects of the same type and grows it into
+the run of neighbouring children that is expected to save the most
+evaluation steps when shared. As evaluation short-circuits, runs at the
+start of the children are worth more than those further back. The run
+is moved into an intermediate object, which replaces it in place in all
+objects sharing it, in the example
+  [a and b and c], [(a and b and c) and x], [(a and b and c) and y]
+As the children stay in the same order, evaluation short-circuits at the
+same child as before. The value of an intermediate object is cached like any
+other, so each rule using it only pays for its evaluation once per
+configuration.
 """
 
+import heapq
+from collections import OrderedDict
+from operator import itemgetter
+
+from result_set import ResultSetBuilder
+
 
 TYPE_AND = 1
 TYPE_OR = 2
 
+# probability of a child to end the evaluation of its parent, used to
+# estimate the gain of factoring out common sub-expressions
+SHORT_CIRCUIT_PROBABILITY = 0.5
+
+# maximum number of configurations remembered per expression object that
+# is evaluated through is_true(), 0 disables the result cache
+RESULT_CACHE_SIZE = 0
+
 expression_object_dict = {}
 
 basic_value_dict = {
@@ -106,6 +181,13 @@ class ExpressionObject():
         self._type = TYPE_AND
         self._children = []
         self._inverted_child_indices = []
+        self._support = None
+        self._support_getter = None
+        # created on the first lookup, only objects evaluated through
+        # is_true() need one
+        self._result_cache = None
+        self._cache_hits = 0
+        self._cache_misses = 0
         self.parse_expression(self._expression)
 
     def __str__(self):
@@ -123,7 +205,51 @@ class ExpressionObject():
         Call this function from outside of of expression objects. Do
         not use this function to get the value of children of this
         expression object, use _evaluate_children on these instead.
+
+        If the value is not cached and RESULT_CACHE_SIZE is set, it is
+        looked up in the result cache by the current values of the support set first, another configuration
+        may have yielded it before. This is only done here and not for every
+        sub-expression, building the key is about as expensive as evaluating
+        a small sub-expression. Neither is it done for lazily fetched basic
+        values, as building the key would fetch the whole support set.
+        """
+        if RESULT_CACHE_SIZE == 0 or self._cached_value is not None:
+            if type(basic_value_dict) is dict:
+                return self._evaluate_children(list())
+            return self._evaluate_root()
+        if isinstance(basic_value_dict, LazyBasicValueDict):
+            return self._evaluate_root()
+        if self._result_cache is None:
+            self._result_cache = OrderedDict()
+            self._support_getter = itemgetter(*self.get_support())
+        try:
+            cache_key = self._support_getter(basic_value_dict)
+        except KeyError:
+            cache_key = tuple([basic_value_dict.get(name)
+                               for name in self.get_support()])
+        try:
+            self._cached_value = self._result_cache[cache_key]
+        except KeyError:
+            self._cache_misses += 1
+        else:
+            self._cache_hits += 1
+            # move to the end, so it will be the last one to be dropped
+            del self._result_cache[cache_key]
+            self._result_cache[cache_key] = self._cached_value
+            return self._cached_value
+        value = self._evaluate_root()
+        self._result_cache[cache_key] = value
+        if len(self._result_cache) > RESULT_CACHE_SIZE:
+            self._result_cache.popitem(last=False)
+        return value
+
+    def _evaluate_root(self):
+        """ Evaluate this expression from the top, with prefetching if
+        basic_value_dict is a LazyBasicValueDict that asks for it.
         """
+        if (isinstance(basic_value_dict, LazyBasicValueDict) and
+                basic_value_dict.prefetch_count):
+            return self._evaluate_children_prefetching(list())
         return self._evaluate_children(list())
 
     def invalidate(self):
@@ -136,6 +262,38 @@ class ExpressionObject():
         # value is queried.
         self._cached_value = None
 
+    def get_support(self):
+        """ Return the names of all basic values this expression depends
+        on as a sorted tuple.
+
+        The support set is collected from the leaves once and kept.
+        factor_common_subexpressions may replace children afterwards, but
+        the leaves below an object stay the same, so it stays valid.
+        """
+        if self._support is None:
+            if len(self._children) == 0:
+                self._support = (self._expression,)
+            else:
+                names = set()
+                for child in self._children:
+                    names.update(child.get_support())
+                self._support = tuple(sorted(names))
+        return self._support
+
+    def get_cache_statistics(self):
+        """ Return the (hits, misses) of the result cache of this
+        expression object.
+        """
+        return (self._cache_hits, self._cache_misses)
+
+    def clear_result_cache(self):
+        """ Forget all remembered results and reset the statistics.
+        """
+        if self._result_cache is not None:
+            self._result_cache.clear()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
     def _evaluate_children(self, caller_stack):
         """ Evaluate this expression internally. If the value of it
         has been cached and not invalidated, return the cached value.
@@ -187,6 +345,57 @@ class ExpressionObject():
         caller_stack.pop()
         return self._cached_value
 
+    def _evaluate_children_prefetching(self, caller_stack):
+        """ Like _evaluate_children, but before every prefetch_count
+        children, fetch the basic values the next prefetch_count children
+        depend on in one call to the lazy basic_value_dict.
+
+        This is a separate path so that evaluating with a plain dict does
+        not pay for checking whether to prefetch in every object.
+        """
+        if self in caller_stack:
+            raise AssertionError("circular dependency detected object[%s], "
+                                 "caller stack: \n%s"
+                                 % (self._expression,
+                                    " --> ".join([str(obj) for obj in caller_stack])))
+        else:
+            caller_stack.append(self)
+
+        if self._cached_value is not None:
+            caller_stack.pop()
+            return self._cached_value
+        if len(self._children) == 0:
+            try:
+                self._cached_value = basic_value_dict[self._expression]
+                caller_stack.pop()
+                return self._cached_value
+            except KeyError:
+                print("Value for single-statement expression %s not found"
+                      % self._expression)
+
+        count = basic_value_dict.prefetch_count
+        for index, (child, inversion) in enumerate(
+                zip(self._children, self._inverted_child_indices)):
+            if index % count == 0:
+                basic_value_dict.prefetch(basic_value_dict.get_prefetch_names(
+                    self._children[index:index + count]))
+            value = child._evaluate_children_prefetching(caller_stack)
+            if inversion:
+                value = not value
+            if self._type == TYPE_OR and value == True:
+                self._cached_value = True
+                break
+            elif self._type == TYPE_AND and value == False:
+                self._cached_value = False
+                break
+        else:
+            if self._type == TYPE_AND:
+                self._cached_value = True
+            else:
+                self._cached_value = False
+        caller_stack.pop()
+        return self._cached_value
+
     def parse_expression(self, expr_str):
         """ Identify the type of this expression and add all the
         sub-expression (children) of this expression, create them if
@@ -522,6 +731,402 @@ def get_clean_expression_and_inversion(string):
             break
     return (string, inversion)
 
+class BasicValueProvider():
+    """ Interface for fetching basic values from wherever they live.
+
+    Implement get_value, and get_values if the source can fetch multiple
+    values in one call cheaper than one by one.
+    """
+    def get_value(self, name):
+        """ Return the value of the basic value name, raise a KeyError
+        if it does not exist.
+        """
+        raise NotImplementedError
+
+    def get_values(self, names):
+        """ Return a dict with the values of all given names that exist.
+        """
+        values = {}
+        for name in names:
+            try:
+                values[name] = self.get_value(name)
+            except KeyError:
+                pass
+        return values
+
+
+class LazyValueStore():
+    """ The bookkeeping of lazily fetched basic values, shared by
+    LazyBasicValueDict and expression_object_async.AsyncLazyBasicValueDict.
+
+    Remembers the fetched values and the names that do not exist, so
+    nothing is asked from the provider twice.
+    Use a new one for each configuration that gets evaluated.
+    If prefetch_count is set, evaluating an expression object first fetches
+    the basic values its next prefetch_count children depend on in one call
+    to get_values, at most max_prefetch_names of them.
+    """
+    # upper limit for the names fetched in one bulk call when prefetching
+    max_prefetch_names = 64
+    # returned by _get_known_value for names not asked for yet, None may
+    # be a value
+    _NOT_FETCHED = object()
+
+    def __init__(self, provider, prefetch_count=0):
+        self.provider = provider
+        self.prefetch_count = prefetch_count
+        self._values = {}
+        self._missing = set()
+        self.num_fetched = 0
+        self.num_provider_calls = 0
+
+    def _get_known_value(self, name):
+        """ return the value of name if it has been fetched already,
+        raise a KeyError if it is known not to exist and return
+        _NOT_FETCHED if it has not been asked for yet.
+        """
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        if name in self._missing:
+            raise KeyError(name)
+        return self._NOT_FETCHED
+
+    def _store_value(self, name, value):
+        self.num_provider_calls += 1
+        self._values[name] = value
+        self.num_fetched += 1
+
+    def _store_missing(self, name):
+        self.num_provider_calls += 1
+        self._missing.add(name)
+
+    def get_prefetch_names(self, children):
+        """ return the names of the basic values the expression objects
+        children depend on, the single-value children themselves and the
+        support sets of the others, at most max_prefetch_names of them.
+        """
+        names = []
+        for child in children:
+            names.extend(child.get_support())
+            if len(names) >= self.max_prefetch_names:
+                return names[:self.max_prefetch_names]
+        return names
+
+    def _get_unknown_names(self, names):
+        """ return the names that have neither been fetched nor are known
+        not to exist.
+        """
+        return [name for name in set(names)
+                if name not in self._values and name not in self._missing]
+
+    def _store_values(self, names, values):
+        """ Store the result of one bulk call for names.
+        """
+        self.num_provider_calls += 1
+        self._values.update(values)
+        self.num_fetched += len(values)
+        self._missing.update([name for name in names if name not in values])
+
+
+class LazyBasicValueDict(LazyValueStore):
+    """ Read-only stand-in for basic_value_dict that fetches each value
+    from a BasicValueProvider on first access and remembers it, see
+    LazyValueStore.
+    """
+    def __getitem__(self, name):
+        value = self._get_known_value(name)
+        if value is not self._NOT_FETCHED:
+            return value
+        try:
+            value = self.provider.get_value(name)
+        except KeyError:
+            self._store_missing(name)
+            raise
+        self._store_value(name, value)
+        return value
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def prefetch(self, names):
+        """ Fetch all values of names that have not been fetched yet in
+        one call to the provider.
+        """
+        names = self._get_unknown_names(names)
+        if names:
+            self._store_values(names, self.provider.get_values(names))
+
+
+def _get_child_expression(child, inversion):
+    """ return the expression string of a child as it would appear
+    in the expression of its parent.
+    """
+    if len(child._children) == 0:
+        child_str = child._expression
+    else:
+        child_str = "(%s)" % child._expression
+    if inversion:
+        child_str = "!" + child_str
+    return child_str
+
+def _get_child_items(exp_obj):
+    """ return the children of an expression object as list of
+    (expression, inversion) items.
+    """
+    return [(child._expression, inversion) for child, inversion
+            in zip(exp_obj._children, exp_obj._inverted_child_indices)]
+
+def _get_adjacent_pairs(exp_obj):
+    """ return all the pairs of neighbouring children of an AND or OR
+    expression object as (type, item, next item).
+    """
+    items = _get_child_items(exp_obj)
+    return set([(exp_obj._type, items[i], items[i + 1])
+                for i in range(len(items) - 1)])
+
+def _find_run(items, run):
+    """ return the index of the first occurrence of the list run in the
+    list items, or -1.
+    """
+    for i in range(len(items) - len(run) + 1):
+        if items[i:i + len(run)] == run:
+            return i
+    return -1
+
+def _get_run_item_expression(item):
+    expr_str, inversion = item
+    return _get_child_expression(expression_object_dict[expr_str], inversion)
+
+def _get_run_object(run, joiner):
+    """ return the existing expression object consisting of exactly the
+    children in run, or None.
+    """
+    run_expr_str = joiner.join([_get_run_item_expression(item) for item in run])
+    return expression_object_dict.get(strip_expression(run_expr_str))
+
+def _get_reach_probabilities():
+    """ return a dict with the probability of each expression object to
+    be evaluated at all, assuming every child ends the evaluation of its
+    parent with SHORT_CIRCUIT_PROBABILITY. Objects that are no child of
+    any other object are the root expressions and always evaluated.
+    """
+    continue_probability = 1.0 - SHORT_CIRCUIT_PROBABILITY
+    num_parents = dict([(exp_obj, 0) for exp_obj
+                        in expression_object_dict.values()])
+    for exp_obj in expression_object_dict.values():
+        for child in exp_obj._children:
+            num_parents[child] = num_parents.get(child, 0) + 1
+    # probability of not being evaluated by any of the parents seen so far
+    not_reached = dict([(exp_obj, 0.0) for exp_obj, count
+                        in num_parents.items() if count == 0])
+    reach = {}
+    ready = list(not_reached)
+    while ready:
+        exp_obj = ready.pop()
+        reach[exp_obj] = 1.0 - not_reached[exp_obj]
+        for index, child in enumerate(exp_obj._children):
+            not_reached[child] = not_reached.get(child, 1.0) * (
+                1.0 - reach[exp_obj] * continue_probability ** index)
+            num_parents[child] -= 1
+            if num_parents[child] == 0:
+                ready.append(child)
+    return reach
+
+def _get_run_savings(run, objs, joiner, reach):
+    """ return the expected number of evaluation steps saved by moving
+    the run of children out of the objects objs into one object.
+
+    Each child is assumed to end the evaluation of its parent with
+    SHORT_CIRCUIT_PROBABILITY, so a run starting at index i of an object
+    that is evaluated with the probability r (see reach) is reached with
+    r * (1 - p) ** i and then costs e = 1 + (1 - p) + (1 - p) ** 2 ...
+    steps for its n children. Moved into its own object, every parent
+    reaching it needs a single step and the new object the e steps once
+    per configuration. An existing object consisting of exactly the run
+    is reused, its e steps are only counted as far as it would not have
+    been evaluated anyway.
+    """
+    run_obj = _get_run_object(run, joiner)
+    continue_probability = 1.0 - SHORT_CIRCUIT_PROBABILITY
+    run_steps = sum([continue_probability ** i for i in range(len(run))])
+    reached = sum([reach.get(exp_obj, 1.0) * continue_probability **
+                   _find_run(_get_child_items(exp_obj), run)
+                   for exp_obj in objs if exp_obj is not run_obj])
+    if run_obj is None:
+        return reached * (run_steps - 1) - run_steps
+    return (reached * (run_steps - 1) -
+            run_steps * (1.0 - reach.get(run_obj, 0.0)))
+
+def _extend_run(run, objs, joiner, min_occurrences, reach):
+    """ Grow the run of children to the left and right as long as that
+    saves more evaluation steps, even if fewer objects share the longer
+    run.
+
+    return the run and the objects that share it.
+    """
+    while True:
+        best = None
+        best_savings = _get_run_savings(run, objs, joiner, reach)
+        for side in (-1, 1):
+            candidates = {}
+            for exp_obj in objs:
+                items = _get_child_items(exp_obj)
+                start = _find_run(items, run)
+                index = start - 1 if side < 0 else start + len(run)
+                if 0 <= index < len(items):
+                    candidates.setdefault(items[index], []).append(exp_obj)
+            for item in sorted(candidates):
+                item_objs = candidates[item]
+                if len(item_objs) < min_occurrences:
+                    continue
+                new_run = [item] + run if side < 0 else run + [item]
+                savings = _get_run_savings(new_run, item_objs, joiner, reach)
+                if savings > best_savings:
+                    best = (new_run, item_objs)
+                    best_savings = savings
+        if best is None:
+            return run, objs
+        run, objs = best
+
+def factor_common_subexpressions(min_occurrences=2):
+    """ Move runs of neighbouring children that are shared by at least
+    min_occurrences AND or OR expression objects into intermediate
+    expression objects, until no run is left whose extraction saves
+    child references.
+
+    Only neighbouring children are extracted and they are replaced in
+    place, so the order in which children are evaluated (and where
+    evaluation short-circuits) stays the same.
+    A run is only extracted if that is expected to save evaluation steps,
+    see _get_run_savings.
+    Every object keeps its value and the set of leaves below it, so cached
+    support sets and result caches remain valid across the rewrite.
+
+    return the number of expression objects that were created.
+    """
+    reach = _get_reach_probabilities()
+    # (type, item, next item) -> objects that contain the pair
+    occurrences = {}
+    for exp_obj in list(expression_object_dict.values()):
+        for pair in _get_adjacent_pairs(exp_obj):
+            occurrences.setdefault(pair, set()).add(exp_obj)
+
+    heap = [(-len(objs), pair) for pair, objs in occurrences.items()
+            if len(objs) >= min_occurrences]
+    heapq.heapify(heap)
+    num_created = 0
+    while heap:
+        neg_count, pair = heapq.heappop(heap)
+        objs = occurrences.get(pair, ())
+        if len(objs) != -neg_count:
+            # outdated entry, the current count has been pushed again
+            continue
+        exp_type, item_1, item_2 = pair
+        joiner = " and " if exp_type == TYPE_AND else " or "
+        run, run_objs = _extend_run([item_1, item_2],
+                                    sorted(objs, key=lambda obj: obj._expression),
+                                    joiner, min_occurrences, reach)
+        if _get_run_savings(run, run_objs, joiner, reach) <= 0:
+            continue
+        run_obj = _get_run_object(run, joiner)
+        if run_obj is None:
+            run_obj = get_or_create_expression_object(
+                joiner.join([_get_run_item_expression(item) for item in run]))
+            num_created += 1
+        # objects created while factoring are not used as parents of runs,
+        # their probability only matters for the run object itself
+        not_reached = 1.0 - reach.get(run_obj, 0.0)
+        for exp_obj in run_objs:
+            if exp_obj is not run_obj:
+                not_reached *= 1.0 - reach.get(exp_obj, 1.0) * (
+                    1.0 - SHORT_CIRCUIT_PROBABILITY) ** _find_run(
+                        _get_child_items(exp_obj), run)
+        reach[run_obj] = 1.0 - not_reached
+
+        changed_pairs = set()
+        for exp_obj in run_objs:
+            if exp_obj is run_obj:
+                continue
+            for old_pair in _get_adjacent_pairs(exp_obj):
+                occurrences[old_pair].discard(exp_obj)
+                changed_pairs.add(old_pair)
+            children = list(zip(exp_obj._children,
+                                exp_obj._inverted_child_indices))
+            start = _find_run(_get_child_items(exp_obj), run)
+            children[start:start + len(run)] = [(run_obj, False)]
+            exp_obj._children = [child for child, inversion in children]
+            exp_obj._inverted_child_indices = [inversion for child, inversion
+                                               in children]
+            for new_pair in _get_adjacent_pairs(exp_obj):
+                occurrences.setdefault(new_pair, set()).add(exp_obj)
+                changed_pairs.add(new_pair)
+
+        # push the changed counts, outdated entries are skipped when popped
+        for changed_pair in changed_pairs:
+            count = len(occurrences[changed_pair])
+            if count >= min_occurrences:
+                heapq.heappush(heap, (-count, changed_pair))
+    return num_created
+
+def evaluate_configurations(expr_strs, configurations, as_result_sets=False):
+    """ Evaluate all expressions for each of the configurations, which are
+    used as basic_value_dict one after the other.
+
+    return a list per expression with its value for each configuration,
+    or a ResultSet per expression of the indices of the configurations it
+    is true for if as_result_sets is set.
+    """
+    global basic_value_dict
+    exp_objs = [get_or_create_expression_object(expr_str)
+                for expr_str in expr_strs]
+    if as_result_sets:
+        collectors = [ResultSetBuilder() for exp_obj in exp_objs]
+    else:
+        collectors = [[] for exp_obj in exp_objs]
+    previous_basic_value_dict = basic_value_dict
+    try:
+        for configuration in configurations:
+            basic_value_dict = configuration
+            invalidate_all_objects()
+            for exp_obj, collector in zip(exp_objs, collectors):
+                collector.append(exp_obj.is_true())
+    finally:
+        basic_value_dict = previous_basic_value_dict
+        # the cached values belong to the last configuration
+        invalidate_all_objects()
+    if as_result_sets:
+        return [builder.build() for builder in collectors]
+    return collectors
+
 def invalidate_all_objects():
     for exp_obj in expression_object_dict.values():
         exp_obj.invalidate()
+
+def clear_all_result_caches():
+    for exp_obj in expression_object_dict.values():
+        if exp_obj._result_cache is not None:
+            exp_obj.clear_result_cache()
+
+def get_cache_statistics():
+    """ Return the summed up (hits, misses) of the result caches of
+    all expression objects.
+    """
+    hits = 0
+    misses = 0
+    for exp_obj in expression_object_dict.values():
+        obj_hits, obj_misses = exp_obj.get_cache_statistics()
+        hits += obj_hits
+        misses += obj_misses
+    return (hits, misses)
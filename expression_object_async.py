@@ -0,0 +1,177 @@
+"""
+Evaluating expression objects with basic values that are fetched from an
+asynchronous source.
+
+The expression objects themselves are the same as in expression_object,
+only the walk through the children is done by coroutines here, so the
+event loop can do other work while a basic value is being fetched.
+Values are fetched lazily on first access and remembered for the rest of
+the evaluation, like with expression_object.LazyBasicValueDict.
+As several evaluations for different configurations may run at the same
+time, the values of the evaluated expression objects are not cached in the
+objects themselves, but in the AsyncLazyBasicValueDict of the evaluation.
+"""
+
+import asyncio
+
+from expression_object import TYPE_AND, TYPE_OR
+from expression_object import LazyValueStore
+
+
+class AsyncBasicValueProvider():
+    """ Interface for fetching basic values asynchronously.
+
+    Implement get_value, and get_values if the source can fetch multiple
+    values in one call cheaper than one by one.
+    """
+    async def get_value(self, name):
+        """ Return the value of the basic value name, raise a KeyError
+        if it does not exist.
+        """
+        raise NotImplementedError
+
+    async def get_values(self, names):
+        """ Return a dict with the values of all given names that exist.
+        """
+        results = await asyncio.gather(*[self.get_value(name)
+                                         for name in names],
+                                       return_exceptions=True)
+        values = {}
+        for name, result in zip(names, results):
+            if isinstance(result, KeyError):
+                continue
+            if isinstance(result, BaseException):
+                raise result
+            values[name] = result
+        return values
+
+
+class AsyncLazyBasicValueDict(LazyValueStore):
+    """ Fetches each value from an AsyncBasicValueProvider on first access
+    and remembers it, see LazyValueStore. Also keeps the values of the
+    expression objects evaluated with it.
+
+    Evaluations running at the same time with the same
+    AsyncLazyBasicValueDict wait for a value that is already being fetched
+    instead of fetching it again.
+    """
+    def __init__(self, provider, prefetch_count=0):
+        LazyValueStore.__init__(self, provider, prefetch_count)
+        # expression object -> its value for this configuration
+        self._results = {}
+        # name -> task that is fetching it
+        self._pending = {}
+
+    def get_result(self, exp_obj):
+        """ return the value of the expression object exp_obj for this
+        configuration, or None if it has not been evaluated yet.
+        """
+        return self._results.get(exp_obj)
+
+    def set_result(self, exp_obj, value):
+        self._results[exp_obj] = value
+
+    async def get_value(self, name):
+        """ Return the value of name, raise a KeyError if it does not
+        exist.
+        """
+        value = self._get_known_value(name)
+        if value is not self._NOT_FETCHED:
+            return value
+        try:
+            task = self._pending[name]
+        except KeyError:
+            task = asyncio.ensure_future(self._fetch(name))
+            self._pending[name] = task
+        await task
+        value = self._get_known_value(name)
+        if value is self._NOT_FETCHED:
+            # not part of the result of a bulk call
+            raise KeyError(name)
+        return value
+
+    async def prefetch(self, names):
+        """ Fetch all values of names that have not been fetched yet in
+        one call to the provider, and wait for those already being fetched.
+        """
+        names = self._get_unknown_names(names)
+        tasks = set([self._pending[name] for name in names
+                     if name in self._pending])
+        names = [name for name in names if name not in self._pending]
+        if names:
+            task = asyncio.ensure_future(self._fetch_values(names))
+            for name in names:
+                self._pending[name] = task
+            tasks.add(task)
+        for task in tasks:
+            await task
+
+    async def _fetch(self, name):
+        try:
+            value = await self.provider.get_value(name)
+        except KeyError:
+            self._store_missing(name)
+        else:
+            self._store_value(name, value)
+        finally:
+            del self._pending[name]
+
+    async def _fetch_values(self, names):
+        try:
+            self._store_values(names, await self.provider.get_values(names))
+        finally:
+            for name in names:
+                del self._pending[name]
+
+
+async def is_true_async(exp_obj, values):
+    """ Evaluate the expression object exp_obj, fetching the basic values
+    it needs from values, an AsyncLazyBasicValueDict.
+    """
+    return await _evaluate_children_async(exp_obj, values, list())
+
+async def _evaluate_children_async(exp_obj, values, caller_stack):
+    """ The asynchronous equivalent of
+    ExpressionObject._evaluate_children, see there. The values of the
+    objects are cached in values instead of the objects.
+    """
+    if exp_obj in caller_stack:
+        raise AssertionError("circular dependency detected object[%s], "
+                             "caller stack: \n%s"
+                             % (exp_obj._expression,
+                                " --> ".join([str(obj) for obj in caller_stack])))
+    else:
+        caller_stack.append(exp_obj)
+
+    value = values.get_result(exp_obj)
+    if value is not None:
+        caller_stack.pop()
+        return value
+    if len(exp_obj._children) == 0:
+        try:
+            value = await values.get_value(exp_obj._expression)
+            values.set_result(exp_obj, value)
+            caller_stack.pop()
+            return value
+        except KeyError:
+            print("Value for single-statement expression %s not found"
+                  % exp_obj._expression)
+
+    result = exp_obj._type == TYPE_AND
+    for index, (child, inversion) in enumerate(
+            zip(exp_obj._children, exp_obj._inverted_child_indices)):
+        if values.prefetch_count and index % values.prefetch_count == 0:
+            await values.prefetch(values.get_prefetch_names(
+                exp_obj._children[index:index + values.prefetch_count]))
+        value = await _evaluate_children_async(child, values, caller_stack)
+        if inversion:
+            value = not value
+        if exp_obj._type == TYPE_OR and value == True:
+            result = True
+            break
+        elif exp_obj._type == TYPE_AND and value == False:
+            result = False
+            break
+    values.set_result(exp_obj, result)
+    caller_stack.pop()
+    return result
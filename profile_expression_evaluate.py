@@ -63,6 +63,7 @@ def profile_object_eval(times):
     results = []
     for i in range(times):
         expression_object.invalidate_all_objects()
+        expression_object.clear_all_result_caches()
         for exp in expression_list:
             exp_obj = get_or_create_expression_object(exp)
             result = exp_obj.is_true()
@@ -76,20 +77,23 @@ def profile_object_eval(times):
 # ALL the object's cached values in each iteration.
 # this would mean that the configuration of base-values has changed
 # completely, which is the worst-case that could happen.
-times = 1
-for i in range(5):
-    expression_object.basic_value_dict = base_value_dict
-    expression_object.expression_object_dict = {}
-    for key, value in base_value_dict.items():
-        exec("%s = %s" % (key, value))
-    print "evaluating %i time(s)" % times
-    t1 = time.time()
-    res_py = profile_python_eval(times)
-    t2 = time.time()
-    res_obj = profile_object_eval(times)
-    t3 = time.time()
-    print "python eval took %f" % (t2 - t1)
-    print "object eval took %f" % (t3 - t2)
-    times *= 10
+# the per-object result caches are cleared as well, otherwise every
+# iteration after the first one would be answered from them.
+if __name__ == "__main__":
+    times = 1
+    for i in range(5):
+        expression_object.basic_value_dict = base_value_dict
+        expression_object.expression_object_dict = {}
+        for key, value in base_value_dict.items():
+            exec("%s = %s" % (key, value))
+        print("evaluating %i time(s)" % times)
+        t1 = time.time()
+        res_py = profile_python_eval(times)
+        t2 = time.time()
+        res_obj = profile_object_eval(times)
+        t3 = time.time()
+        print("python eval took %f" % (t2 - t1))
+        print("object eval took %f" % (t3 - t2))
+        times *= 10
 
-#print "results do match: " + str(res_py == res_obj)
+    #print("results do match: " + str(res_py == res_obj))
@@ -0,0 +1,102 @@
+"""
+Compare the expression objects of a corpus before and after factoring
+common sub-expressions.
+Child references are the evaluation steps needed if nothing short-circuits.
+Evaluation steps are the number of calls to _evaluate_children, counted
+for one evaluation of the complete corpus with empty caches.
+"""
+
+import random
+import time
+
+import expression_object
+from expression_object import ExpressionObject
+from expression_object import get_or_create_expression_object
+from profile_expression_evaluate import create_random_expressions
+
+evaluation_steps = [0]
+_evaluate_children = ExpressionObject._evaluate_children
+
+def counting_evaluate_children(self, caller_stack):
+    evaluation_steps[0] += 1
+    return _evaluate_children(self, caller_stack)
+
+ExpressionObject._evaluate_children = counting_evaluate_children
+
+def evaluate_corpus(expression_list):
+    expression_object.invalidate_all_objects()
+    expression_object.clear_all_result_caches()
+    evaluation_steps[0] = 0
+    results = []
+    for exp in expression_list:
+        exp_obj = get_or_create_expression_object(exp)
+        results.append(exp_obj.is_true())
+    return results, evaluation_steps[0]
+
+def count_child_references():
+    return sum([len(exp_obj._children) for exp_obj
+                in expression_object.expression_object_dict.values()])
+
+def create_prefix_expressions(num_base_values, num_prefixes, num_expressions,
+                              out_expression_list, out_base_value_dict):
+    """ Create rules that are AND chains of one of num_prefixes shared
+    chains of 3 to 8 values, followed by 1 to 4 values of their own, like
+      value_1 and value_7 and value_3 and value_42
+      value_1 and value_7 and value_3 and !value_13
+    Most base values are true, like settings that are mostly switched on.
+    """
+    random.seed(0)
+    names = ["value_%i" % i for i in range(num_base_values)]
+    for name in names:
+        out_base_value_dict[name] = random.randint(0, 9) > 0
+    prefixes = []
+    for i in range(num_prefixes):
+        prefixes.append([random.choice(["", "!"]) + name for name
+                         in random.sample(names, random.randint(3, 8))])
+    for i in range(num_expressions):
+        values = list(random.choice(prefixes))
+        for j in range(random.randint(1, 4)):
+            values.append(random.choice(["", "!"]) + random.choice(names))
+        out_expression_list.append(" and ".join(values))
+
+def profile_factoring(name, expression_list, base_value_dict):
+    expression_object.basic_value_dict = base_value_dict
+    expression_object.expression_object_dict = {}
+
+    results_before, steps_before = evaluate_corpus(expression_list)
+    nodes_before = len(expression_object.expression_object_dict)
+    refs_before = count_child_references()
+
+    t1 = time.time()
+    num_created = expression_object.factor_common_subexpressions()
+    t2 = time.time()
+
+    results_after, steps_after = evaluate_corpus(expression_list)
+    nodes_after = len(expression_object.expression_object_dict)
+    refs_after = count_child_references()
+
+    print("%s, factoring took %f" % (name, t2 - t1))
+    print("  created %i intermediate objects" % num_created)
+    print("  objects: %i -> %i" % (nodes_before, nodes_after))
+    print("  child references: %i -> %i" % (refs_before, refs_after))
+    print("  evaluation steps: %i -> %i" % (steps_before, steps_after))
+    print("  results do match: " + str(results_before == results_after))
+
+for num_base_values, num_expressions in [(100, 1000), (100, 10000),
+                                         (1000, 10000)]:
+    expression_list = []
+    base_value_dict = {}
+    create_random_expressions(num_base_values, num_expressions, 40,
+                              expression_list, base_value_dict)
+    profile_factoring("%i random expressions over %i base values"
+                      % (num_expressions, num_base_values),
+                      expression_list, base_value_dict)
+
+for num_prefixes, num_expressions in [(50, 1000), (200, 10000)]:
+    expression_list = []
+    base_value_dict = {}
+    create_prefix_expressions(100, num_prefixes, num_expressions,
+                              expression_list, base_value_dict)
+    profile_factoring("%i expressions sharing %i AND prefixes"
+                      % (num_expressions, num_prefixes),
+                      expression_list, base_value_dict)
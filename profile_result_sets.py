@@ -0,0 +1,46 @@
+"""
+Compare the memory needed for the results of evaluating a corpus over many
+configurations, kept as lists of booleans or as compressed ResultSets.
+The configurations start from the same base values and each has a few of
+them flipped, like profiles that only differ in some settings.
+The size of the lists is what evaluate_configurations would return without
+as_result_sets, a pointer per result. Both sides are measured with
+sys.getsizeof, including all the python objects of the result sets.
+"""
+
+import random
+import sys
+import time
+
+import expression_object
+from expression_object import evaluate_configurations
+from profile_expression_evaluate import create_random_expressions
+
+expression_list = []
+base_value_dict = {}
+create_random_expressions(100, 1000, 40, expression_list, base_value_dict)
+expression_object.expression_object_dict = {}
+
+for num_configurations, num_flipped in [(2000, 1), (2000, 10), (2000, 50)]:
+    random.seed(1)
+    names = sorted(base_value_dict)
+    configurations = []
+    for i in range(num_configurations):
+        configuration = dict(base_value_dict)
+        for name in random.sample(names, num_flipped):
+            configuration[name] = not configuration[name]
+        configurations.append(configuration)
+
+    t1 = time.time()
+    result_sets = evaluate_configurations(expression_list, configurations,
+                                          as_result_sets=True)
+    t2 = time.time()
+
+    list_bytes = (sys.getsizeof([False] * num_configurations) *
+                  len(expression_list))
+    set_bytes = sum([result_set.get_size_in_bytes()
+                     for result_set in result_sets])
+    print("%i expressions x %i configurations, %i values flipped, took %f"
+          % (len(expression_list), num_configurations, num_flipped, t2 - t1))
+    print("  lists: %i bytes, result sets: %i bytes (%.1f%%)"
+          % (list_bytes, set_bytes, 100.0 * set_bytes / list_bytes))
@@ -0,0 +1,333 @@
+"""
+Compressed sets of results for evaluating many expressions over many
+configurations.
+
+Keeping the results as a list of booleans costs a pointer per result, which
+does not fit into memory anymore for something like 10k expressions times
+50k configurations. A ResultSet instead stores the indices of the
+configurations an expression is true for, compressed similar to a Roaring
+bitmap:
+The indices are split into chunks of 2^16 by their upper bits. Chunks without
+any true result are not stored at all, every other chunk is stored in
+whichever container needs the least memory for it:
+  ARRAY   sorted array of the set positions, 2 bytes per set position
+  RUN     array of (start, last) pairs of runs of set positions,
+          4 bytes per run
+  BITMAP  one bit per position as python int, up to 8 kilobytes
+So an expression that is (almost) always true or always false costs next to
+nothing and memory only grows with how much the results actually vary.
+
+Sets can be combined with &, | and ~ and counted without expanding them into
+single results, mixed containers are combined as bitmaps and stored in the
+best container again.
+"""
+
+import sys
+from array import array
+from bisect import bisect_right
+
+CONTAINER_ARRAY = 1
+CONTAINER_RUN = 2
+CONTAINER_BITMAP = 3
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+# an array container holding more positions would be larger than a bitmap
+MAX_ARRAY_SIZE = 4096
+BITMAP_BYTES = CHUNK_SIZE // 8
+
+
+def _popcount(bits):
+    return bin(bits).count("1")
+
+def _iter_bits(bits):
+    """ yield the positions of all set bits of the int bits, ascending.
+    """
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for byte_index, byte in enumerate(bytearray(data)):
+        if not byte:
+            continue
+        for bit in range(8):
+            if (byte >> bit) & 1:
+                yield (byte_index << 3) + bit
+
+def _positions_to_bits(positions):
+    buf = bytearray(BITMAP_BYTES)
+    for pos in positions:
+        buf[pos >> 3] |= 1 << (pos & 7)
+    return _bytes_to_bits(buf)
+
+def _bytes_to_bits(buf):
+    return int.from_bytes(bytes(buf), "little")
+
+def _to_bits(container):
+    """ return the positions of a container as python int bitmap.
+    """
+    kind, data = container
+    if kind == CONTAINER_BITMAP:
+        return data
+    elif kind == CONTAINER_ARRAY:
+        return _positions_to_bits(data)
+    bits = 0
+    for i in range(0, len(data), 2):
+        start = data[i]
+        last = data[i + 1]
+        bits |= ((1 << (last - start + 1)) - 1) << start
+    return bits
+
+def _from_bits(bits):
+    """ return the smallest container for the python int bitmap bits,
+    or None if no bit is set.
+    """
+    if not bits:
+        return None
+    num_positions = _popcount(bits)
+    run_starts = bits & ~(bits << 1)
+    num_runs = _popcount(run_starts)
+    # a python int only needs the bytes up to its highest set bit
+    bitmap_bytes = (bits.bit_length() + 7) // 8
+    if num_runs * 4 < min(num_positions * 2, bitmap_bytes):
+        run_lasts = bits & ~(bits >> 1)
+        data = array("H")
+        for start, last in zip(_iter_bits(run_starts), _iter_bits(run_lasts)):
+            data.append(start)
+            data.append(last)
+        return (CONTAINER_RUN, data)
+    if num_positions * 2 < bitmap_bytes:
+        return (CONTAINER_ARRAY, array("H", _iter_bits(bits)))
+    return (CONTAINER_BITMAP, bits)
+
+def _container_count(container):
+    kind, data = container
+    if kind == CONTAINER_ARRAY:
+        return len(data)
+    elif kind == CONTAINER_RUN:
+        return sum([data[i + 1] - data[i] + 1
+                    for i in range(0, len(data), 2)])
+    return _popcount(data)
+
+def _container_contains(container, pos):
+    kind, data = container
+    if kind == CONTAINER_ARRAY:
+        index = bisect_right(data, pos)
+        return index > 0 and data[index - 1] == pos
+    elif kind == CONTAINER_RUN:
+        # binary search for the last run starting at or before pos
+        low = 0
+        high = len(data) // 2
+        while low < high:
+            mid = (low + high) // 2
+            if data[mid * 2] <= pos:
+                low = mid + 1
+            else:
+                high = mid
+        return low > 0 and data[(low - 1) * 2 + 1] >= pos
+    return bool((data >> pos) & 1)
+
+def _iter_container(container):
+    kind, data = container
+    if kind == CONTAINER_ARRAY:
+        return iter(data)
+    elif kind == CONTAINER_RUN:
+        return (pos for i in range(0, len(data), 2)
+                for pos in range(data[i], data[i + 1] + 1))
+    return _iter_bits(data)
+
+def _container_size_in_bytes(container):
+    """ return the bytes used by the container tuple and its data, as
+    measured by sys.getsizeof. The kind is a cached small int.
+    """
+    kind, data = container
+    return sys.getsizeof(container) + sys.getsizeof(data)
+
+
+class ResultSet():
+    """ Compressed set of the indices (of configurations) for which an
+    expression is true, out of size indices overall.
+    """
+    # there may be lots of result sets, don't give each one a __dict__
+    __slots__ = ("size", "_containers")
+
+    def __init__(self, size, containers=None):
+        self.size = size
+        # upper bits of the index -> container of the lower bits
+        self._containers = containers if containers is not None else {}
+
+    @classmethod
+    def from_positions(cls, size, positions):
+        """ Create a result set of the given, ascending positions.
+        """
+        builder = ResultSetBuilder()
+        for pos in positions:
+            builder.add(pos)
+        return builder.build(size)
+
+    @classmethod
+    def from_bools(cls, values):
+        builder = ResultSetBuilder()
+        for value in values:
+            builder.append(value)
+        return builder.build()
+
+    def __repr__(self):
+        return "ResultSet(%i, count=%i)" % (self.size, self.count())
+
+    def __contains__(self, pos):
+        try:
+            container = self._containers[pos >> CHUNK_BITS]
+        except KeyError:
+            return False
+        return _container_contains(container, pos & CHUNK_MASK)
+
+    def __iter__(self):
+        for key in sorted(self._containers):
+            offset = key << CHUNK_BITS
+            for pos in _iter_container(self._containers[key]):
+                yield offset + pos
+
+    def __eq__(self, other):
+        if not isinstance(other, ResultSet):
+            return NotImplemented
+        return (self.size == other.size and
+                sorted(self._containers) == sorted(other._containers) and
+                all([_to_bits(container) == _to_bits(other._containers[key])
+                     for key, container in self._containers.items()]))
+
+    def __and__(self, other):
+        self._check_size(other)
+        containers = {}
+        for key, container in self._containers.items():
+            try:
+                other_container = other._containers[key]
+            except KeyError:
+                continue
+            new_container = _from_bits(_to_bits(container) &
+                                       _to_bits(other_container))
+            if new_container is not None:
+                containers[key] = new_container
+        return ResultSet(self.size, containers)
+
+    def __or__(self, other):
+        self._check_size(other)
+        containers = dict(self._containers)
+        for key, other_container in other._containers.items():
+            try:
+                container = containers[key]
+            except KeyError:
+                containers[key] = other_container
+                continue
+            containers[key] = _from_bits(_to_bits(container) |
+                                         _to_bits(other_container))
+        return ResultSet(self.size, containers)
+
+    def __invert__(self):
+        containers = {}
+        num_chunks = (self.size + CHUNK_SIZE - 1) >> CHUNK_BITS
+        for key in range(num_chunks):
+            chunk_size = min(CHUNK_SIZE, self.size - (key << CHUNK_BITS))
+            full_bits = (1 << chunk_size) - 1
+            try:
+                bits = _to_bits(self._containers[key])
+            except KeyError:
+                containers[key] = (CONTAINER_RUN, array("H", [0, chunk_size - 1]))
+                continue
+            new_container = _from_bits(full_bits & ~bits)
+            if new_container is not None:
+                containers[key] = new_container
+        return ResultSet(self.size, containers)
+
+    def count(self):
+        """ return the number of set positions.
+        """
+        return sum([_container_count(container)
+                    for container in self._containers.values()])
+
+    def get_size_in_bytes(self):
+        """ return the number of bytes used by this result set including
+        all its python objects, as measured by sys.getsizeof.
+        """
+        return (sys.getsizeof(self) + sys.getsizeof(self._containers) +
+                sum([_container_size_in_bytes(container)
+                     for container in self._containers.values()]))
+
+    def _check_size(self, other):
+        if self.size != other.size:
+            raise ValueError("result sets of different sizes %i and %i"
+                             % (self.size, other.size))
+
+
+class ResultSetBuilder():
+    """ Build a ResultSet from results that come in one after the other.
+
+    Only the chunk that is currently being filled is kept uncompressed.
+    build() may be called multiple times, each returned ResultSet holds
+    what had been added up to then.
+    """
+    def __init__(self):
+        self.size = 0
+        self._containers = {}
+        self._chunk_key = 0
+        self._positions = array("H")
+        self._buf = None
+
+    def append(self, value):
+        """ Append the next result.
+        """
+        if value:
+            self.add(self.size)
+        else:
+            self.size += 1
+
+    def add(self, pos):
+        """ Set the position pos, positions have to be added ascending.
+        """
+        key = pos >> CHUNK_BITS
+        if key != self._chunk_key:
+            self._flush()
+            self._chunk_key = key
+        low_pos = pos & CHUNK_MASK
+        if self._buf is not None:
+            self._buf[low_pos >> 3] |= 1 << (low_pos & 7)
+        else:
+            self._positions.append(low_pos)
+            if len(self._positions) > MAX_ARRAY_SIZE:
+                self._buf = bytearray(BITMAP_BYTES)
+                for low_pos in self._positions:
+                    self._buf[low_pos >> 3] |= 1 << (low_pos & 7)
+                self._positions = array("H")
+        self.size = max(self.size, pos + 1)
+
+    def build(self, size=None):
+        """ return the ResultSet of everything added so far, covering size
+        positions (by default everything that has been appended).
+        """
+        self._flush()
+        if size is None:
+            size = self.size
+        # the builder may go on adding, the result set must not change
+        return ResultSet(size, dict(self._containers))
+
+    def _flush(self):
+        if self._buf is not None:
+            bits = _bytes_to_bits(self._buf)
+        else:
+            bits = _positions_to_bits(self._positions) if self._positions else 0
+        try:
+            # the chunk was flushed before by build()
+            bits |= _to_bits(self._containers[self._chunk_key])
+        except KeyError:
+            pass
+        container = _from_bits(bits)
+        if container is not None:
+            self._containers[self._chunk_key] = container
+        self._positions = array("H")
+        self._buf = None
+
+
+def find_sets_containing(result_sets, pos):
+    """ return the indices of all result sets that contain the position
+    pos, like all the expressions that are true for one configuration.
+    """
+    return [index for index, result_set in enumerate(result_sets)
+            if pos in result_set]
@@ -26,3 +26,58 @@ simple_exprs_and_results = [("a and b", True),
 def test_evaluate_expressions(expr_str, expected_value):
     exp_obj = get_or_create_expression_object(expr_str)
     assert exp_obj.is_true() == expected_value
+
+def test_support_set():
+    exp_obj = get_or_create_expression_object("(b or !a) and (c or a)")
+    assert exp_obj.get_support() == ("a", "b", "c")
+    assert get_or_create_expression_object("!d").get_support() == ("d",)
+
+def test_result_cache_across_configurations(monkeypatch):
+    monkeypatch.setattr(expression_object, "RESULT_CACHE_SIZE", 16)
+    config_1 = dict(basic_value_dict)
+    config_2 = dict(basic_value_dict, a=False)
+    exp_obj = get_or_create_expression_object("a and (c or b)")
+    exp_obj.clear_result_cache()
+    for config, expected_value in [(config_1, True), (config_2, False),
+                                   (config_1, True), (config_2, False)]:
+        monkeypatch.setattr(expression_object, "basic_value_dict", config)
+        expression_object.invalidate_all_objects()
+        assert exp_obj.is_true() == expected_value
+    assert exp_obj.get_cache_statistics() == (2, 2)
+
+    # d is not in the support set, changing it must still hit the cache
+    monkeypatch.setattr(expression_object, "basic_value_dict",
+                        dict(config_1, d=True))
+    expression_object.invalidate_all_objects()
+    assert exp_obj.is_true() == True
+    assert exp_obj.get_cache_statistics() == (3, 2)
+
+def test_result_cache_size(monkeypatch):
+    monkeypatch.setattr(expression_object, "RESULT_CACHE_SIZE", 1)
+    exp_obj = get_or_create_expression_object("b or d")
+    exp_obj.clear_result_cache()
+    for value in [True, False, True]:
+        monkeypatch.setattr(expression_object, "basic_value_dict",
+                            dict(basic_value_dict, b=value))
+        expression_object.invalidate_all_objects()
+        assert exp_obj.is_true() == value
+    assert exp_obj.get_cache_statistics() == (0, 3)
+
+def test_result_cache_disabled(monkeypatch):
+    monkeypatch.setattr(expression_object, "RESULT_CACHE_SIZE", 0)
+    exp_obj = get_or_create_expression_object("b and !c")
+    exp_obj.clear_result_cache()
+    for i in range(2):
+        expression_object.invalidate_all_objects()
+        assert exp_obj.is_true() == True
+    assert exp_obj.get_cache_statistics() == (0, 0)
+
+def test_result_cache_only_at_root(monkeypatch):
+    monkeypatch.setattr(expression_object, "RESULT_CACHE_SIZE", 16)
+    exp_obj = get_or_create_expression_object("a and (c or b)")
+    child = get_or_create_expression_object("c or b")
+    expression_object.clear_all_result_caches()
+    expression_object.invalidate_all_objects()
+    exp_obj.is_true()
+    assert exp_obj.get_cache_statistics() == (0, 1)
+    assert child.get_cache_statistics() == (0, 0)
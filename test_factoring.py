@@ -0,0 +1,72 @@
+import pytest
+
+import expression_object
+from expression_object import get_or_create_expression_object
+from expression_object import factor_common_subexpressions
+from expression_object import TYPE_AND
+
+basic_value_dict = {
+    "a" : True,
+    "b" : True,
+    "c" : False,
+    "x" : True,
+    "y" : False,
+    "z" : True}
+
+exprs_and_results = [("a and b and !c and x", True),
+                     ("a and b and !c and y", False),
+                     ("z or (a and b and !c and z)", True),
+                     ("y or c or x", True),
+                     ("(y or c) and a", False),
+                     ("!(c or y) and a", True)]
+
+@pytest.fixture
+def corpus(monkeypatch):
+    monkeypatch.setattr(expression_object, "basic_value_dict", basic_value_dict)
+    monkeypatch.setattr(expression_object, "expression_object_dict", {})
+    return [get_or_create_expression_object(expr_str)
+            for expr_str, expected_value in exprs_and_results]
+
+def test_factor_common_subexpressions(corpus):
+    object_dict = expression_object.expression_object_dict
+    num_objects = len(object_dict)
+    num_created = factor_common_subexpressions()
+    assert num_created == len(object_dict) - num_objects
+    assert num_created == 1
+
+    # the three AND chains now share [a and b and !c], in the same place
+    # and order as before
+    shared = object_dict["a and b and !c"]
+    assert shared._type == TYPE_AND
+    assert shared._children == [object_dict["a"], object_dict["b"],
+                                object_dict["c"]]
+    assert shared._inverted_child_indices == [False, False, True]
+    assert corpus[0]._children == [shared, object_dict["x"]]
+    assert corpus[0]._inverted_child_indices == [False, False]
+    assert corpus[1]._children == [shared, object_dict["y"]]
+    assert corpus[1]._inverted_child_indices == [False, False]
+    assert corpus[2]._children[1]._children == [shared, object_dict["z"]]
+
+    # the existing [y or c] is evaluated anyway and can be reused,
+    # [c or y] is in a different order
+    assert corpus[3]._children == [object_dict["y or c"], object_dict["x"]]
+    assert corpus[5]._children[0]._children == [object_dict["c"],
+                                                object_dict["y"]]
+
+def test_factoring_reuses_existing_objects(corpus):
+    existing = get_or_create_expression_object("(a and b and !c)")
+    assert factor_common_subexpressions() == 0
+    assert corpus[0]._children == [existing,
+                                   expression_object.expression_object_dict["x"]]
+    assert existing._children[0]._expression == "a"
+
+def test_factoring_keeps_results(corpus):
+    factor_common_subexpressions(min_occurrences=2)
+    expression_object.invalidate_all_objects()
+    expression_object.clear_all_result_caches()
+    for exp_obj, (expr_str, expected_value) in zip(corpus, exprs_and_results):
+        assert exp_obj.is_true() == expected_value
+
+def test_factoring_min_occurrences(corpus):
+    assert factor_common_subexpressions(min_occurrences=4) == 0
+    assert len(expression_object.expression_object_dict["y or c or x"]._children) == 3
@@ -0,0 +1,108 @@
+import random
+
+import pytest
+
+import expression_object
+from expression_object import evaluate_configurations
+from result_set import ResultSet
+from result_set import ResultSetBuilder
+from result_set import find_sets_containing
+from result_set import CHUNK_SIZE
+from result_set import CONTAINER_ARRAY, CONTAINER_RUN, CONTAINER_BITMAP
+
+size = 3 * CHUNK_SIZE + 100
+
+def make_result_sets():
+    random.seed(1)
+    positions = [
+        # sparse
+        sorted(random.sample(range(size), 300)),
+        # long runs, chunk 1 completely empty
+        list(range(10, 20000)) + list(range(2 * CHUNK_SIZE, size)),
+        # dense and noisy
+        [pos for pos in range(3 * CHUNK_SIZE) if random.randint(0, 2) > 0],
+        []]
+    return positions, [ResultSet.from_positions(size, pos_list)
+                       for pos_list in positions]
+
+def test_containers():
+    positions, result_sets = make_result_sets()
+    kinds = [set([kind for kind, data in result_set._containers.values()])
+             for result_set in result_sets]
+    assert kinds == [set([CONTAINER_ARRAY]), set([CONTAINER_RUN]),
+                     set([CONTAINER_BITMAP]), set()]
+    assert sorted(result_sets[1]._containers) == [0, 2, 3]
+    empty_size = result_sets[3].get_size_in_bytes()
+    assert empty_size > 0
+    # three runs, each in its own container
+    run_size = result_sets[1].get_size_in_bytes() - empty_size
+    assert 3 * 4 < run_size < 3 * 200
+    assert result_sets[2].get_size_in_bytes() > 3 * 8192
+
+def test_count_contains_iter():
+    positions, result_sets = make_result_sets()
+    for pos_list, result_set in zip(positions, result_sets):
+        assert result_set.count() == len(pos_list)
+        assert list(result_set) == pos_list
+        pos_set = set(pos_list)
+        for pos in range(0, size, 997):
+            assert (pos in result_set) == (pos in pos_set)
+
+def test_set_operations():
+    positions, result_sets = make_result_sets()
+    all_positions = set(range(size))
+    pos_sets = [set(pos_list) for pos_list in positions]
+    for pos_set_1, result_set_1 in zip(pos_sets, result_sets):
+        assert set(~result_set_1) == all_positions - pos_set_1
+        for pos_set_2, result_set_2 in zip(pos_sets, result_sets):
+            assert set(result_set_1 & result_set_2) == pos_set_1 & pos_set_2
+            assert set(result_set_1 | result_set_2) == pos_set_1 | pos_set_2
+    assert ~~result_sets[2] == result_sets[2]
+    assert result_sets[0] != result_sets[1]
+
+def test_different_sizes():
+    with pytest.raises(ValueError):
+        ResultSet(10) & ResultSet(11)
+
+def test_from_bools():
+    values = [True, False, False, True, True]
+    result_set = ResultSet.from_bools(values)
+    assert result_set.size == 5
+    assert list(result_set) == [0, 3, 4]
+    assert list(~result_set) == [1, 2]
+
+def test_build_twice():
+    builder = ResultSetBuilder()
+    builder.append(True)
+    first = builder.build()
+    builder.append(True)
+    builder.add(CHUNK_SIZE + 5)
+    second = builder.build()
+    assert first.size == 1
+    assert list(first) == [0]
+    assert second.size == CHUNK_SIZE + 6
+    assert list(second) == [0, 1, CHUNK_SIZE + 5]
+
+def test_evaluate_configurations(monkeypatch):
+    monkeypatch.setattr(expression_object, "expression_object_dict", {})
+    expr_strs = ["a and b", "a or !b", "!a"]
+    configurations = [{"a" : a, "b" : b}
+                      for a in (True, False) for b in (True, False)]
+    values = evaluate_configurations(expr_strs, configurations)
+    assert values == [[True, False, False, False],
+                      [True, True, False, True],
+                      [False, False, True, True]]
+    result_sets = evaluate_configurations(expr_strs, configurations,
+                                          as_result_sets=True)
+    assert result_sets == [ResultSet.from_bools(value_list)
+                           for value_list in values]
+    assert find_sets_containing(result_sets, 3) == [1, 2]
+
+def test_evaluate_configurations_restores_values(monkeypatch):
+    monkeypatch.setattr(expression_object, "expression_object_dict", {})
+    monkeypatch.setattr(expression_object, "basic_value_dict",
+                        {"a" : True, "b" : True})
+    exp_obj = expression_object.get_or_create_expression_object("a and b")
+    assert exp_obj.is_true() == True
+    evaluate_configurations(["a and b"], [{"a" : False, "b" : True}])
+    assert exp_obj.is_true() == True
@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+import expression_object
+from expression_object import get_or_create_expression_object
+from expression_object import BasicValueProvider
+from expression_object import LazyBasicValueDict
+from expression_object_async import AsyncBasicValueProvider
+from expression_object_async import AsyncLazyBasicValueDict
+from expression_object_async import is_true_async
+
+basic_values = {
+    "a" : True,
+    "b" : True,
+    "c" : False,
+    "d" : False}
+
+class RecordingProvider(BasicValueProvider):
+    def __init__(self):
+        self.calls = []
+
+    def get_value(self, name):
+        self.calls.append([name])
+        return basic_values[name]
+
+    def get_values(self, names):
+        self.calls.append(sorted(names))
+        return dict([(name, basic_values[name]) for name in names])
+
+class AsyncRecordingProvider(AsyncBasicValueProvider):
+    def __init__(self, values=basic_values, delay=0):
+        self.calls = []
+        self.values = values
+        self.delay = delay
+
+    async def get_value(self, name):
+        self.calls.append([name])
+        await asyncio.sleep(self.delay)
+        return self.values[name]
+
+@pytest.fixture(autouse=True)
+def object_dict(monkeypatch):
+    monkeypatch.setattr(expression_object, "expression_object_dict", {})
+
+@pytest.mark.parametrize(("prefetch_count", "expected_calls"),
+                         [(0, [["a"], ["c"]]),
+                          (2, [["a", "c"]]),
+                          (4, [["a", "b", "c", "d"]])])
+def test_lazy_values(monkeypatch, prefetch_count, expected_calls):
+    provider = RecordingProvider()
+    values = LazyBasicValueDict(provider, prefetch_count)
+    monkeypatch.setattr(expression_object, "basic_value_dict", values)
+    exp_obj = get_or_create_expression_object("a and c and b and d")
+    assert exp_obj.is_true() == False
+    assert provider.calls == expected_calls
+    assert values.num_provider_calls == len(expected_calls)
+
+def test_lazy_values_fetched_once(monkeypatch):
+    monkeypatch.setattr(expression_object, "RESULT_CACHE_SIZE", 16)
+    provider = RecordingProvider()
+    monkeypatch.setattr(expression_object, "basic_value_dict",
+                        LazyBasicValueDict(provider))
+    exp_obj = get_or_create_expression_object("(a and c) or (!c and a)")
+    assert exp_obj.is_true() == True
+    assert provider.calls == [["a"], ["c"]]
+    # the result cache would have fetched the whole support set
+    assert exp_obj.get_cache_statistics() == (0, 0)
+
+def test_lazy_values_missing():
+    provider = RecordingProvider()
+    values = LazyBasicValueDict(provider)
+    assert values.get("x") is None
+    assert "x" not in values
+    values.prefetch(["x", "a"])
+    assert provider.calls == [["x"], ["a"]]
+    assert values["a"] == True
+
+def test_lazy_values_none():
+    provider = AsyncRecordingProvider({"n" : None})
+    values = AsyncLazyBasicValueDict(provider)
+    assert asyncio.run(values.get_value("n")) is None
+    assert asyncio.run(values.get_value("n")) is None
+    assert provider.calls == [["n"]]
+
+def test_default_get_values():
+    provider = RecordingProvider()
+    assert BasicValueProvider.get_values(provider, ["a", "x"]) == {"a" : True}
+
+@pytest.mark.parametrize(("prefetch_count", "expected_provider_calls"),
+                         [(0, 2), (2, 1)])
+def test_async_lazy_values(prefetch_count, expected_provider_calls):
+    provider = AsyncRecordingProvider()
+    values = AsyncLazyBasicValueDict(provider, prefetch_count)
+    exp_obj = get_or_create_expression_object("a and c and b and d")
+    assert asyncio.run(is_true_async(exp_obj, values)) == False
+    assert sorted(provider.calls) == [["a"], ["c"]]
+    assert values.num_provider_calls == expected_provider_calls
+
+def test_async_concurrent_evaluations():
+    exp_obj = get_or_create_expression_object("(a or b) and c")
+    values_1 = AsyncLazyBasicValueDict(AsyncRecordingProvider(
+        {"a" : True, "b" : True, "c" : True}, delay=0.01))
+    values_2 = AsyncLazyBasicValueDict(AsyncRecordingProvider(
+        {"a" : False, "b" : False, "c" : True}, delay=0.01))
+
+    async def evaluate_later(values):
+        await asyncio.sleep(0.015)
+        return await is_true_async(exp_obj, values)
+
+    async def evaluate_both():
+        return await asyncio.gather(is_true_async(exp_obj, values_1),
+                                    evaluate_later(values_2))
+
+    assert asyncio.run(evaluate_both()) == [True, False]
+    assert exp_obj._cached_value is None
+
+def test_async_shared_values():
+    provider = AsyncRecordingProvider(delay=0.01)
+    values = AsyncLazyBasicValueDict(provider)
+    exp_obj_1 = get_or_create_expression_object("a and b")
+    exp_obj_2 = get_or_create_expression_object("a and !c")
+
+    async def evaluate_both():
+        return await asyncio.gather(is_true_async(exp_obj_1, values),
+                                    is_true_async(exp_obj_2, values))
+
+    assert asyncio.run(evaluate_both()) == [True, True]
+    assert sorted(provider.calls) == [["a"], ["b"], ["c"]]
+
+def test_prefetch_composite_children(monkeypatch):
+    provider = RecordingProvider()
+    monkeypatch.setattr(expression_object, "basic_value_dict",
+                        LazyBasicValueDict(provider, prefetch_count=4))
+    exp_obj = get_or_create_expression_object("(a or c) and (c or d) and (b or d)")
+    assert exp_obj.is_true() == False
+    assert provider.calls == [["a", "b", "c", "d"]]
+
+def test_prefetch_limit(monkeypatch):
+    provider = RecordingProvider()
+    values = LazyBasicValueDict(provider, prefetch_count=4)
+    values.max_prefetch_names = 2
+    monkeypatch.setattr(expression_object, "basic_value_dict", values)
+    exp_obj = get_or_create_expression_object("(a or c) and (c or d)")
+    assert exp_obj.is_true() == False
+    assert provider.calls == [["a", "c"], ["d"]]
+
+def test_async_prefetch_composite_children():
+    provider = AsyncRecordingProvider()
+    values = AsyncLazyBasicValueDict(provider, prefetch_count=4)
+    exp_obj = get_or_create_expression_object("(a or c) and (c or d) and (b or d)")
+    assert asyncio.run(is_true_async(exp_obj, values)) == False
+    assert values.num_provider_calls == 1